@@ -1,10 +1,34 @@
+import argparse
+import ast
+import base64
 import json
 import os
 import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import accumulate, islice
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from github import Github, GithubException
 
+try:
+    import orjson  # optional: faster encoding of the output rows
+except ImportError:
+    orjson = None
+
 # ================== CONFIG ==================
 TOKEN_PATH = "github_token.txt"
+GRAPHQL_URL = "https://api.github.com/graphql"
 
 REPO_LIST_PATH = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\dataset\top_python_repos.jsonl"
 OUTPUT_PATH = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\dataset\pr_review_samples.jsonl"
@@ -18,9 +42,50 @@ REPO_LIMIT = 50
 # rule parameters
 PROBE_PRS = 10       # check first 10 PRs
 PROBE_MIN_EXAMPLES = 2
+
+# concurrency
+PARALLEL_PRS = 8               # PRs scraped concurrently per repo
+SECONDS_BETWEEN_REQUESTS = 0.05
+RATE_LIMIT_FLOOR = 100         # pause before a batch when fewer core requests remain
+GRAPHQL_RATE_LIMIT_FLOOR = 200 # pause before the next PR page when fewer GraphQL points remain (~51/page)
+SECONDARY_LIMIT_WAIT = 60      # seconds to back off on a secondary limit without Retry-After
+
+# GraphQL page size (PRs per request) and review threads fetched per PR
+GRAPHQL_PR_PAGE = 50
+GRAPHQL_THREADS_PER_PR = 100
+
+# base-sha file contents kept per repo, keyed by (repo, sha, path)
+FILE_CACHE_SIZE = 512
+FILE_PREFETCH_WORKERS = 4      # concurrent base-file downloads within one PR
+# PRs touching this many files resolve blob SHAs from one recursive tree listing,
+# so unchanged files are downloaded once per blob rather than once per base commit
+TREE_MIN_FILES = 3
+TREE_CACHE_SIZE = 8            # base commits whose {path: blob_sha} maps are kept
+
+# on-disk cache shared across runs
+CACHE_PATH = os.path.join(".cache", "github.sqlite")
+MAX_CACHE_AGE_DAYS = 7         # PR listing pages older than this are fetched again
 # ============================================
 
 
+def _dumps(obj):
+    # UTF-8 JSON bytes; the one encoder for output rows and disk cache values
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass  # e.g. integers beyond 64 bits; json handles them
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def dump_jsonl_line(obj):
+    return _dumps(obj) + b"\n"
+
+
+def _loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
 def load_token(token_path):
     with open(token_path, "r", encoding="utf-8") as f:
         return f.read().strip()
@@ -37,38 +102,432 @@ def load_repo_list(jsonl_path):
     return repos
 
 
+# (type, login) pairs already classified as bots. GraphQL reports Bot authors without
+# the "[bot]" suffix REST uses, so the common ones are seeded in both forms; keying on
+# the type keeps a User who shares a login with a Bot from being misclassified.
+_KNOWN_BOTS = ("dependabot", "github-actions", "pre-commit-ci", "renovate")
+_BOT_CACHE = {("Bot", name) for name in _KNOWN_BOTS} | {("Bot", name + "[bot]") for name in _KNOWN_BOTS}
+
+
 def is_bot(user_obj):
+    # PyGithub users and _gql_user() both always carry .login and .type
     if user_obj is None:
         return True
-    if getattr(user_obj, "type", None) == "Bot":
+    key = (user_obj.type, user_obj.login or "")
+    if key in _BOT_CACHE:
         return True
-    login = getattr(user_obj, "login", "") or ""
-    if login.endswith("[bot]"):
+    if key[0] == "Bot" or key[1].endswith("[bot]"):
+        _BOT_CACHE.add(key)
         return True
     return False
 
 
-def get_file_content_at_commit(repo, file_path, sha):
+########################
+# persistent cache (survives re-runs)
+########################
+
+# File contents at a commit SHA and blobs by blob SHA never change, so they are kept
+# for good. PR listing pages do change (new threads, re-ordering by update time) and
+# expire after max_age_days. Values are zlib-compressed JSON.
+_DISK_CACHE = None
+_DISK_CACHE_LOCK = threading.Lock()
+_PAGE_MAX_AGE_S = MAX_CACHE_AGE_DAYS * 86400
+
+
+def open_disk_cache(path=CACHE_PATH, max_age_days=MAX_CACHE_AGE_DAYS):
+    global _DISK_CACHE, _PAGE_MAX_AGE_S
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, value BLOB)")
+    conn.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, value BLOB, stored_at REAL)")
+    _PAGE_MAX_AGE_S = max_age_days * 86400
+    conn.execute("DELETE FROM pages WHERE stored_at < ?", (time.time() - _PAGE_MAX_AGE_S,))
+    conn.commit()
+    _DISK_CACHE = conn
+
+
+def close_disk_cache():
+    global _DISK_CACHE
+    if _DISK_CACHE is not None:
+        _DISK_CACHE.close()
+        _DISK_CACHE = None
+
+
+def _disk_get(table, key):
+    if _DISK_CACHE is None:
+        return None
+    with _DISK_CACHE_LOCK:
+        if table == "pages":
+            row = _DISK_CACHE.execute(
+                "SELECT value FROM pages WHERE key = ? AND stored_at >= ?",
+                (key, time.time() - _PAGE_MAX_AGE_S),
+            ).fetchone()
+        else:
+            row = _DISK_CACHE.execute("SELECT value FROM files WHERE key = ?", (key,)).fetchone()
+    return None if row is None else _loads(zlib.decompress(row[0]))
+
+
+def _disk_put(table, key, value):
+    if _DISK_CACHE is None:
+        return
+    data = zlib.compress(_dumps(value), 6)
+    with _DISK_CACHE_LOCK:
+        if table == "pages":
+            _DISK_CACHE.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", (key, data, time.time()))
+        else:
+            _DISK_CACHE.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (key, data))
+        _DISK_CACHE.commit()
+
+
+# repo objects aren't hashable, so the cache keys on full_name and looks the handle up here
+_REPO_HANDLES = {}
+
+
+# (repo_full_name, base_sha) -> {path: blob_sha} for .py blobs, least recently used first
+_BLOB_SHAS = OrderedDict()
+_BLOB_SHAS_LOCK = threading.Lock()
+
+
+def _resolve_blob_shas(repo, sha):
+    key = (repo.full_name, sha)
+    with _BLOB_SHAS_LOCK:
+        if key in _BLOB_SHAS:
+            _BLOB_SHAS.move_to_end(key)
+            return _BLOB_SHAS[key]
+    # one call for the whole tree; if GitHub truncates it, missing paths fall back to get_contents
+    tree = repo.get_git_tree(sha, recursive=True)
+    blob_shas = {el.path: el.sha for el in tree.tree if el.type == "blob" and el.path.endswith(".py")}
+    with _BLOB_SHAS_LOCK:
+        _BLOB_SHAS[key] = blob_shas
+        while len(_BLOB_SHAS) > TREE_CACHE_SIZE:
+            _BLOB_SHAS.popitem(last=False)
+    return blob_shas
+
+
+@lru_cache(maxsize=FILE_CACHE_SIZE)
+def _fetch_blob_lines(repo_full_name, blob_sha):
+    # blob SHAs are content hashes, so the disk entry is valid for any repo
+    disk_key = f"blob:{blob_sha}"
+    lines = _disk_get("files", disk_key)
+    if lines is not None:
+        return lines
+    blob = _REPO_HANDLES[repo_full_name].get_git_blob(blob_sha)
+    raw = base64.b64decode(blob.content) if blob.encoding == "base64" else blob.content.encode("utf-8")
+    lines = raw.decode("utf-8", errors="replace").splitlines()
+    _disk_put("files", disk_key, lines)
+    return lines
+
+
+@lru_cache(maxsize=FILE_CACHE_SIZE)
+def _fetch_lines(repo_full_name, sha, file_path):
+    # raises GithubException on failure, so errors are never cached
+    with _BLOB_SHAS_LOCK:
+        blob_sha = _BLOB_SHAS.get((repo_full_name, sha), {}).get(file_path)
+    if blob_sha is not None:
+        return _fetch_blob_lines(repo_full_name, blob_sha)
+    disk_key = f"file:{repo_full_name}:{sha}:{file_path}"
+    lines = _disk_get("files", disk_key)
+    if lines is not None:
+        return lines
+    file_content = _REPO_HANDLES[repo_full_name].get_contents(file_path, ref=sha)
+    text = file_content.decoded_content.decode("utf-8", errors="replace")
+    lines = text.splitlines()
+    _disk_put("files", disk_key, lines)
+    return lines
+
+
+@lru_cache(maxsize=FILE_CACHE_SIZE)
+def _fetch_text_index(repo_full_name, sha, file_path):
+    return build_text_index(_fetch_lines(repo_full_name, sha, file_path))
+
+
+def _at_commit(cached_fetch, repo, file_path, sha):
+    # shared front door for the (repo, sha, path)-keyed caches
     if sha is None:
         return None
+    _REPO_HANDLES[repo.full_name] = repo
     try:
-        file_content = repo.get_contents(file_path, ref=sha)
+        return cached_fetch(repo.full_name, sha, file_path)
     except GithubException:
         return None
-    text = file_content.decoded_content.decode("utf-8", errors="replace")
-    return text.splitlines()
+
+
+def get_file_content_at_commit(repo, file_path, sha):
+    return _at_commit(_fetch_lines, repo, file_path, sha)
+
+
+def get_text_index_at_commit(repo, file_path, sha):
+    return _at_commit(_fetch_text_index, repo, file_path, sha)
+
+
+def prefetch_files_at_commit(repo, file_paths, sha):
+    """Warm the line cache for several files concurrently so the emit loop only hits the cache."""
+    if sha is None or len(file_paths) < 2:
+        return
+    if len(file_paths) >= TREE_MIN_FILES:
+        try:
+            _resolve_blob_shas(repo, sha)
+        except GithubException:
+            pass  # per-file get_contents still works
+    with ThreadPoolExecutor(max_workers=min(FILE_PREFETCH_WORKERS, len(file_paths))) as ex:
+        list(ex.map(lambda path: get_file_content_at_commit(repo, path, sha), file_paths))
+
+
+def clear_file_cache():
+    _fetch_lines.cache_clear()
+    _fetch_blob_lines.cache_clear()
+    with _BLOB_SHAS_LOCK:
+        _BLOB_SHAS.clear()
+    _fetch_text_index.cache_clear()
+    _fetch_block_index.cache_clear()
+    _fetch_indent_profile.cache_clear()
+    _REPO_HANDLES.clear()
+
+
+########################
+# bulk PR + review comment listing (GraphQL)
+########################
+
+# The query is read-only, so POSTs are safe to retry on transient 5xx responses; pooled
+# so the probe/deep phases reuse connections. Rate limits (403/429 or RATE_LIMITED errors)
+# are not retried here: fetch_pr_comments_bulk sleeps until the reset instead.
+GRAPHQL_SESSION = requests.Session()
+GRAPHQL_SESSION.mount("https://", HTTPAdapter(
+    max_retries=Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+))
+
+# Only the first comment of each review thread is requested: replies are
+# filtered out downstream anyway.
+PR_COMMENTS_QUERY = """
+query($owner: String!, $name: String!, $first: Int!, $threads: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: $first, after: $after, states: [CLOSED, MERGED],
+                 orderBy: {field: UPDATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number
+        baseRefOid
+        author { login __typename }
+        reviewThreads(first: $threads) {
+          pageInfo { hasNextPage }
+          nodes {
+            comments(first: 1) {
+              nodes {
+                databaseId
+                body
+                path
+                diffHunk
+                author { login __typename }
+                replyTo { databaseId }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class GraphQLError(Exception):
+    """The GraphQL API answered, but with errors instead of the requested page."""
+
+
+def _seconds_until_reset(r):
+    reset = r.headers.get("x-ratelimit-reset")
+    if reset is None:
+        return SECONDARY_LIMIT_WAIT
+    return max(int(reset) - time.time(), 0) + 1
+
+
+def _graphql_rate_limit_wait(r, payload):
+    """Seconds to sleep before retrying a rate-limited GraphQL response, or None if it isn't one."""
+    retry_after = r.headers.get("retry-after")
+    if retry_after:
+        return int(retry_after)
+    errors = (payload or {}).get("errors") or ()
+    if r.headers.get("x-ratelimit-remaining") == "0" or any(e.get("type") == "RATE_LIMITED" for e in errors):
+        return _seconds_until_reset(r)
+    if r.status_code in (403, 429) and "rate limit" in r.text.lower():
+        return SECONDARY_LIMIT_WAIT  # secondary limit without a Retry-After
+    return None
+
+
+def fetch_pr_comments_bulk(token, owner, name, after_cursor=None):
+    """
+    Return one `pullRequests` connection page (PRs with their review comments).
+    Pages are served from the disk cache while younger than the max cache age.
+    """
+    # the query hash keeps pages cached under an older query shape from being reused
+    query_tag = zlib.crc32(PR_COMMENTS_QUERY.encode("utf-8"))
+    disk_key = f"prs:{query_tag:08x}:{owner}/{name}:{GRAPHQL_PR_PAGE}:{GRAPHQL_THREADS_PER_PR}:{after_cursor or ''}"
+    page = _disk_get("pages", disk_key)
+    if page is not None:
+        return page
+    while True:
+        r = GRAPHQL_SESSION.post(
+            GRAPHQL_URL,
+            headers={"Authorization": f"Bearer {token}"},
+            json={
+                "query": PR_COMMENTS_QUERY,
+                "variables": {
+                    "owner": owner,
+                    "name": name,
+                    "first": GRAPHQL_PR_PAGE,
+                    "threads": GRAPHQL_THREADS_PER_PR,
+                    "after": after_cursor,
+                },
+            },
+            timeout=30,
+        )
+        try:
+            payload = r.json()
+        except ValueError:
+            payload = None
+        sleep_s = _graphql_rate_limit_wait(r, payload)
+        if sleep_s is None:
+            break
+        print(f"[rate] GraphQL rate limited, sleeping {int(sleep_s)}s", flush=True)
+        time.sleep(sleep_s)
+    r.raise_for_status()
+    if payload is None:
+        raise GraphQLError(f"GraphQL response for {owner}/{name} is not JSON (HTTP {r.status_code})")
+    if payload.get("errors"):
+        raise GraphQLError(f"GraphQL error for {owner}/{name}: {payload['errors']}")
+    page = payload["data"]["repository"]["pullRequests"]
+    _disk_put("pages", disk_key, page)
+
+    # each page costs ~GRAPHQL_PR_PAGE + 1 points; wait for the reset rather than run dry
+    remaining = r.headers.get("x-ratelimit-remaining")
+    if remaining is not None and int(remaining) < GRAPHQL_RATE_LIMIT_FLOOR:
+        sleep_s = _seconds_until_reset(r)
+        print(f"[rate] {remaining} GraphQL points left, sleeping {int(sleep_s)}s until reset", flush=True)
+        time.sleep(sleep_s)
+    return page
+
+
+def _gql_user(author):
+    # mirror the PyGithub NamedUser attributes is_bot() and the filters read
+    if author is None:
+        return None
+    return SimpleNamespace(login=author.get("login"), type=author.get("__typename"))
+
+
+def _gql_comment(node):
+    reply_to = node.get("replyTo")
+    return SimpleNamespace(
+        id=node.get("databaseId"),
+        in_reply_to_id=reply_to.get("databaseId") if reply_to else None,
+        user=_gql_user(node.get("author")),
+        path=node.get("path"),
+        diff_hunk=node.get("diffHunk"),
+        body=node.get("body"),
+    )
+
+
+def iter_closed_prs_with_comments(token, repo_full_name):
+    """
+    Yield (pr, review_comments) for closed PRs, most recently updated first.
+    `pr` exposes .number/.user/.base.sha like a PyGithub PullRequest, and pages
+    are fetched lazily so callers can stop early.
+    """
+    owner, name = repo_full_name.split("/", 1)
+    cursor = None
+    while True:
+        page = fetch_pr_comments_bulk(token, owner, name, cursor)
+        for node in page["nodes"]:
+            threads = node["reviewThreads"]
+            if threads["pageInfo"]["hasNextPage"]:
+                # comments in the missing threads would be absent from the per-hunk counts,
+                # letting multi-comment hunks pass as singletons
+                print(f"  [skip] PR #{node['number']}: more than {GRAPHQL_THREADS_PER_PR} review threads", flush=True)
+                continue
+            pr = SimpleNamespace(
+                number=node["number"],
+                user=_gql_user(node.get("author")),
+                base=SimpleNamespace(sha=node.get("baseRefOid")),
+            )
+            comments = [
+                _gql_comment(c)
+                for thread in threads["nodes"]
+                for c in thread["comments"]["nodes"]
+            ]
+            yield pr, comments
+        if not page["pageInfo"]["hasNextPage"]:
+            break
+        cursor = page["pageInfo"]["endCursor"]
 
 
 def clamp_line(num, lo, hi):
     return max(lo, min(num, hi))
 
 
+def build_text_index(lines):
+    """
+    (text, line_starts) for the "\n"-joined lines; line_starts[i] is the offset of
+    line i + 1 and line_starts[-1] is len(text) + 1, so any line range is one slice.
+    """
+    line_starts = [0]
+    line_starts.extend(accumulate(len(l) + 1 for l in lines))
+    return "\n".join(lines), line_starts
+
+
+def join_lines(old_lines, start, end, text_index=None):
+    # same result as "\n".join(old_lines[start - 1:end]) for 1 <= start <= end <= len(old_lines)
+    if text_index is None:
+        return "\n".join(old_lines[start - 1:end])
+    text, line_starts = text_index
+    return text[line_starts[start - 1]:line_starts[end] - 1]
+
+
 ########################
 # diff hunk parsing
 ########################
 
 HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+TAG_ADD, TAG_DEL, TAG_CTX = ord("+"), ord("-"), ord(" ")
+
+def _parse_range(tok, sign):
+    # "-12,3" -> (12, 3); a missing length means 1
+    if tok[:1] != sign:
+        raise ValueError(tok)
+    start, comma, length = tok[1:].partition(",")
+    if not start.isdecimal() or (comma and not length.isdecimal()):
+        raise ValueError(tok)
+    return int(start), int(length) if comma else 1
+
+
+def parse_hunk_header(header_line):
+    """
+    (old_start, old_len, new_start, new_len) from "@@ -a[,b] +c[,d] @@ ...", or None.
+    Split-based fast path; anything it doesn't recognise goes through HEADER_RE.
+    """
+    try:
+        at, minus, plus, rest = header_line.split(" ", 3)
+        if at != "@@" or not rest.startswith("@@"):
+            raise ValueError(header_line)
+        return (*_parse_range(minus, "-"), *_parse_range(plus, "+"))
+    except ValueError:
+        m = HEADER_RE.match(header_line)
+        if not m:
+            return None
+        return int(m.group(1)), int(m.group(2) or "1"), int(m.group(3)), int(m.group(4) or "1")
+
+
+def extract_hunk_header(diff_text):
+    # first "@@ -a,b +c,d @@ ..." line, stripped
+    return next((ln.strip() for ln in diff_text.splitlines() if ln.lstrip().startswith("@@")), None)
 
+
+# the same hunk string is parsed again for every comment anchored on it
+@lru_cache(maxsize=2048)
 def parse_diff_hunk(diff_text):
     if not diff_text:
         return None
@@ -76,39 +535,44 @@ def parse_diff_hunk(diff_text):
     if not lines:
         return None
 
-    header_idx = None
-    header_line = None
-    for i, l in enumerate(lines):
-        if l.strip().startswith("@@"):
-            header_idx = i
-            header_line = l.strip()
-            break
+    header_idx = next((i for i, l in enumerate(lines) if l.startswith("@@")), None)
     if header_idx is None:
         return None
+    header_line = lines[header_idx].strip()
 
-    m = HEADER_RE.match(header_line)
-    if not m:
+    header = parse_hunk_header(header_line)
+    if header is None:
         return None
-
-    old_start = int(m.group(1))
-    old_len = int(m.group(2) or "1")
-    new_start = int(m.group(3))
-    new_len = int(m.group(4) or "1")
-
-    hunk_lines = []
+    old_start, old_len, new_start, new_len = header
+
+    # columnar line storage: one tag byte per line, -1 where a line has no old/new number
+    tags = bytearray()
+    texts = []
+    old_nos = array("i")
+    new_nos = array("i")
+    add_tag, add_text, add_old, add_new = tags.append, texts.append, old_nos.append, new_nos.append
     old_line_no = old_start
     new_line_no = new_start
 
     for l in lines[header_idx + 1:]:
-        if l.startswith('+'):
-            hunk_lines.append(('+', l[1:], None, new_line_no))
+        tag = l[:1]
+        if tag == '+':
+            add_tag(TAG_ADD)
+            add_text(l[1:])
+            add_old(-1)
+            add_new(new_line_no)
             new_line_no += 1
-        elif l.startswith('-'):
-            hunk_lines.append(('-', l[1:], old_line_no, None))
+        elif tag == '-':
+            add_tag(TAG_DEL)
+            add_text(l[1:])
+            add_old(old_line_no)
+            add_new(-1)
             old_line_no += 1
         else:
-            text = l[1:] if l.startswith(' ') else l
-            hunk_lines.append((' ', text, old_line_no, new_line_no))
+            add_tag(TAG_CTX)
+            add_text(l[1:] if tag == ' ' else l)
+            add_old(old_line_no)
+            add_new(new_line_no)
             old_line_no += 1
             new_line_no += 1
 
@@ -118,7 +582,10 @@ def parse_diff_hunk(diff_text):
         "old_len": old_len,
         "new_start": new_start,
         "new_len": new_len,
-        "lines": hunk_lines,
+        "tags": tags,
+        "texts": texts,
+        "old_nos": old_nos,
+        "new_nos": new_nos,
     }
 
 
@@ -126,10 +593,8 @@ def get_old_span_from_hunk(hunk):
     if hunk is None:
         return None, None
 
-    old_nos = [
-        old_no for (tag, text, old_no, new_no) in hunk["lines"]
-        if tag in (' ', '-') and old_no is not None
-    ]
+    # only ' ' and '-' lines carry an old line number; '+' lines hold -1
+    old_nos = [old_no for old_no in hunk["old_nos"] if old_no != -1]
     if old_nos:
         return min(old_nos), max(old_nos)
 
@@ -142,12 +607,80 @@ def get_old_span_from_hunk(hunk):
 # context extraction
 ########################
 
-def extract_block_definition(old_lines, anchor_line):
+def build_block_index(source_text):
+    """
+    Sorted (start_line, end_line) spans of every def/class in the source,
+    or None if it doesn't parse (callers fall back to the textual scan).
+    """
+    try:
+        tree = ast.parse(source_text)
+    except (SyntaxError, ValueError):
+        return None
+    return sorted(
+        (node.lineno, node.end_lineno)
+        for node in ast.walk(tree)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    )
+
+
+@lru_cache(maxsize=FILE_CACHE_SIZE)
+def _fetch_block_index(repo_full_name, sha, file_path):
+    # parse the joined lines so AST line numbers index the cached line list
+    text, _ = _fetch_text_index(repo_full_name, sha, file_path)
+    return build_block_index(text)
+
+
+def get_block_index_at_commit(repo, file_path, sha):
+    return _at_commit(_fetch_block_index, repo, file_path, sha)
+
+
+def build_indent_profile(old_lines):
+    """Per-line indent width, blank and decorator flags used by the textual block scan."""
+    n = len(old_lines)
+    stripped = [l.lstrip() for l in old_lines]
+    indents = np.fromiter((len(l) - len(st) for l, st in zip(old_lines, stripped)), dtype=np.int32, count=n)
+    blank = np.fromiter((not st for st in stripped), dtype=bool, count=n)
+    decorator = np.fromiter((st.startswith("@") for st in stripped), dtype=bool, count=n)
+    return indents, blank, decorator
+
+
+@lru_cache(maxsize=FILE_CACHE_SIZE)
+def _fetch_indent_profile(repo_full_name, sha, file_path):
+    return build_indent_profile(_fetch_lines(repo_full_name, sha, file_path))
+
+
+def get_indent_profile_at_commit(repo, file_path, sha):
+    return _at_commit(_fetch_indent_profile, repo, file_path, sha)
+
+
+def innermost_block(block_index, anchor_line):
+    # spans are properly nested, so walking back from the last span starting at or
+    # before the anchor, the first one still open at the anchor is the innermost
+    i = bisect_right(block_index, anchor_line, key=lambda span: span[0])
+    while i > 0:
+        i -= 1
+        start, end = block_index[i]
+        if end >= anchor_line:
+            return start, end
+    return None
+
+
+def extract_block_definition(old_lines, anchor_line, block_index=None, indent_profile=None, text_index=None):
     if not old_lines or anchor_line is None:
         return None
 
     n = len(old_lines)
     anchor_line = clamp_line(anchor_line, 1, n)
+
+    if block_index is not None:
+        span = innermost_block(block_index, anchor_line)
+        if span is None:
+            return None
+        start, end = span
+        if end - start + 1 > MAX_DEF_BLOCK_LINES:
+            return None
+        return join_lines(old_lines, start, end, text_index)
+
     idx = anchor_line - 1
 
     def_idx = None
@@ -184,52 +717,48 @@ def extract_block_definition(old_lines, anchor_line):
     else:
         return None
 
-    end_idx = anchor_start
-    k = anchor_start + 1
-    while k < n:
-        lk = old_lines[k]
-        if lk.strip() == "":
-            end_idx = k
-            k += 1
-            continue
-        cur_indent = len(lk) - len(lk.lstrip())
-        if cur_indent <= anchor_indent and not lk.lstrip().startswith("@"):
-            break
-        end_idx = k
-        k += 1
+    # the block ends before the first non-blank, non-decorator line at or left of the anchor's indent
+    if indent_profile is None:
+        indent_profile = build_indent_profile(old_lines)
+    indents, blank, decorator = indent_profile
+    tail = slice(anchor_start + 1, n)
+    stops = np.flatnonzero(~blank[tail] & (indents[tail] <= anchor_indent) & ~decorator[tail])
+    end_idx = anchor_start + int(stops[0]) if stops.size else n - 1
 
-    block = old_lines[anchor_start:end_idx + 1]
-    if len(block) > MAX_DEF_BLOCK_LINES:
+    if end_idx - anchor_start + 1 > MAX_DEF_BLOCK_LINES:
         return None
-    return "\n".join(block)
+    return join_lines(old_lines, anchor_start + 1, end_idx + 1, text_index)
 
 
-def extract_window_snippet(old_lines, start_line, end_line, radius):
+def extract_window_snippet(old_lines, start_line, end_line, radius, text_index=None):
     if not old_lines or start_line is None or end_line is None:
         return None
 
     n = len(old_lines)
     s = clamp_line(start_line - radius, 1, n)
     e = clamp_line(end_line + radius, 1, n)
-    return "\n".join(old_lines[s - 1:e])
+    return join_lines(old_lines, s, e, text_index)
 
 
 ########################
 # main per-PR scraping
 ########################
 
-def scrape_examples_from_single_pr(repo, pr, max_needed):
+def scrape_examples_from_single_pr(repo, pr, max_needed, review_comments=None):
     out = []
     pr_author = pr.user.login if pr.user else None
     pr_base_sha = getattr(pr.base, "sha", None)
 
-    try:
-        review_comments = list(pr.get_review_comments())
-    except GithubException:
-        return out
+    if review_comments is None:
+        try:
+            review_comments = list(pr.get_review_comments())
+        except GithubException:
+            return out
 
-    # 1) apply all per-comment filters FIRST
-    filtered = []
+    # 1) apply all per-comment filters FIRST, extracting each hunk header once;
+    # 2) count comments per (file_path, hunk header) in the same pass
+    entries = []
+    hunk_counts = Counter()
     for c in review_comments:
         if getattr(c, "in_reply_to_id", None) is not None:
             continue
@@ -247,46 +776,18 @@ def scrape_examples_from_single_pr(repo, pr, max_needed):
         body_text = (c.body or "").strip()
         if not body_text:
             continue
-        filtered.append(c)
-
-    # 2) group AFTER filtering by (file_path, hunk header)
-    groups = {}
-    for c in filtered:
-        file_path = getattr(c, "path", None)
-        diff_hunk = getattr(c, "diff_hunk", None)
-        # extract header (@@ -a,b +c,d @@ ...)
-        header_line = None
-        for ln in diff_hunk.splitlines():
-            if ln.strip().startswith("@@"):
-                header_line = ln.strip()
-                break
-        key = (file_path, header_line)  # <- use header, not full hunk body
-        groups.setdefault(key, []).append(c)
-
-    # 3) keep only hunks that have exactly one comment
-    singletons = {key for key, cs in groups.items() if len(cs) == 1}
-
-    # 4) emit examples only for singleton hunks
-    for c in filtered:
-        if len(out) >= max_needed:
-            break
-
-        file_path = getattr(c, "path", None)
-        diff_hunk = getattr(c, "diff_hunk", None)
-
-        # compute header again to check membership
-        header_line = None
-        for ln in diff_hunk.splitlines():
-            if ln.strip().startswith("@@"):
-                header_line = ln.strip()
-                break
-        key = (file_path, header_line)
-        if key not in singletons:
-            continue
-
-        comment_author = c.user.login if c.user else None
-        body_text = (c.body or "").strip()
+        header_line = extract_hunk_header(diff_hunk)
+        entries.append((c, file_path, header_line, diff_hunk, body_text, comment_author))
+        hunk_counts[(file_path, header_line)] += 1  # <- use header, not full hunk body
+
+    # 3) emit examples only for hunks with exactly one comment, in comment order
+    to_emit = list(islice((e for e in entries if hunk_counts[(e[1], e[2])] == 1), max(max_needed, 0)))
+    if not to_emit:
+        # nothing qualifies: no base-sha file is ever requested for this PR
+        return out
+    prefetch_files_at_commit(repo, {e[1] for e in to_emit}, pr_base_sha)
 
+    for c, file_path, header_line, diff_hunk, body_text, comment_author in to_emit:
         comment_id = getattr(c, "id", None)
         comment_url = (
             f"https://github.com/{repo.full_name}/pull/{pr.number}#discussion_r{comment_id}"
@@ -300,12 +801,19 @@ def scrape_examples_from_single_pr(repo, pr, max_needed):
         context_text = None
         if old_file_lines and old_span_start and old_span_end:
             anchor_line = (old_span_start + old_span_end) // 2
-            block_snippet = extract_block_definition(old_file_lines, anchor_line)
+            text_index = get_text_index_at_commit(repo, file_path, pr_base_sha)
+            block_index = get_block_index_at_commit(repo, file_path, pr_base_sha)
+            indent_profile = (
+                get_indent_profile_at_commit(repo, file_path, pr_base_sha) if block_index is None else None
+            )
+            block_snippet = extract_block_definition(
+                old_file_lines, anchor_line, block_index, indent_profile, text_index
+            )
             if block_snippet:
                 context_text = block_snippet
             else:
                 context_text = extract_window_snippet(
-                    old_file_lines, old_span_start, old_span_end, CONTEXT_RADIUS
+                    old_file_lines, old_span_start, old_span_end, CONTEXT_RADIUS, text_index
                 )
 
         example = {
@@ -327,8 +835,56 @@ def scrape_examples_from_single_pr(repo, pr, max_needed):
 # repo loop with probe rule
 ########################
 
+def wait_for_rate_limit(gh, floor=RATE_LIMIT_FLOOR):
+    remaining, _ = gh.rate_limiting
+    if remaining >= floor:
+        return
+    sleep_s = max(gh.rate_limiting_resettime - time.time(), 0) + 1
+    print(f"[rate] {remaining} requests left, sleeping {int(sleep_s)}s until reset", flush=True)
+    time.sleep(sleep_s)
+
+
+def scrape_prs_parallel(gh, repo, prs, collected, max_examples_per_repo, label, workers=PARALLEL_PRS):
+    """
+    Scrape (pr, review_comments) pairs from the `prs` iterator in batches of `workers`
+    concurrent requests, extending `collected` in PR order until the iterator or the
+    per-repo budget runs out.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        while len(collected) < max_examples_per_repo:
+            batch = []
+            listing_error = None
+            try:
+                for item in islice(prs, workers):
+                    batch.append(item)
+            except (GraphQLError, requests.RequestException) as e:
+                # scrape the PRs already listed and keep what was collected; the PR generator
+                # is finished once it raised, so a later phase over it sees no more PRs either
+                listing_error = e
+                print(f"  [WARN] [{label}] can't list more PRs: {e}", flush=True)
+            if not batch:
+                break
+            wait_for_rate_limit(gh)
+            remaining = max_examples_per_repo - len(collected)
+            for pr, _ in batch:
+                print(f"  [{label}] PR #{pr.number} scanning ...", flush=True)
+            results = ex.map(
+                lambda item: scrape_examples_from_single_pr(repo, item[0], remaining, review_comments=item[1]),
+                batch,
+            )
+            for new_examples in results:
+                if not new_examples:
+                    continue
+                collected.extend(new_examples)
+                for ex_row in new_examples:
+                    print(f"     [OK] {ex_row['repo']} PR#{ex_row['pr_id']} {ex_row['file_path']}", flush=True)
+            if listing_error is not None:
+                break
+
+
 def collect_examples_from_repo_time_order(
     gh,
+    token,
     repo_full_name,
     max_examples_per_repo,
     max_prs_to_scan,
@@ -343,21 +899,16 @@ def collect_examples_from_repo_time_order(
         return []
 
     collected = []
-    pull_list = repo.get_pulls(state="closed", sort="updated", direction="desc")
+    # PRs arrive with their review comments in pages of GRAPHQL_PR_PAGE; single pass,
+    # the deep scan resumes where the probe stopped. Only file contents still go through REST.
+    pr_iter = iter_closed_prs_with_comments(token, repo.full_name)
 
     # ---- PHASE 1: probe first N PRs ----
     print(f"[probe] scanning first {probe_prs} PRs...", flush=True)
-    for idx, pr in enumerate(pull_list):
-        if idx >= probe_prs:
-            break
-        if len(collected) >= max_examples_per_repo:
-            break
-        print(f"  [PR #{pr.number}] scanning ...", flush=True)
-        new_examples = scrape_examples_from_single_pr(repo, pr, max_needed=max_examples_per_repo - len(collected))
-        if new_examples:
-            collected.extend(new_examples)
-            for ex in new_examples:
-                print(f"     [OK] {ex['repo']} PR#{ex['pr_id']} {ex['file_path']}", flush=True)
+    scrape_prs_parallel(
+        gh, repo, islice(pr_iter, probe_prs), collected, max_examples_per_repo,
+        label="probe", workers=min(probe_prs, PARALLEL_PRS),
+    )
 
     probe_count = len(collected)
     print(f"[probe done] {repo_full_name}: found {probe_count} examples in first {probe_prs} PRs", flush=True)
@@ -367,17 +918,10 @@ def collect_examples_from_repo_time_order(
         return collected[:max_examples_per_repo]
 
     # ---- PHASE 2: continue scanning until limits ----
-    for idx, pr in enumerate(pull_list):
-        if idx < probe_prs:
-            continue
-        if idx >= max_prs_to_scan or len(collected) >= max_examples_per_repo:
-            break
-        print(f"  [deep] PR #{pr.number} scanning ...", flush=True)
-        new_examples = scrape_examples_from_single_pr(repo, pr, max_needed=max_examples_per_repo - len(collected))
-        if new_examples:
-            collected.extend(new_examples)
-            for ex in new_examples:
-                print(f"     [OK] {ex['repo']} PR#{ex['pr_id']} {ex['file_path']}", flush=True)
+    scrape_prs_parallel(
+        gh, repo, islice(pr_iter, max(max_prs_to_scan - probe_prs, 0)), collected, max_examples_per_repo,
+        label="deep",
+    )
 
     print(f"[done] {repo_full_name}: total {len(collected)} examples", flush=True)
     return collected[:max_examples_per_repo]
@@ -388,12 +932,22 @@ def collect_examples_from_repo_time_order(
 ########################
 
 def main():
+    ap = argparse.ArgumentParser(description="Collect single-comment review examples from closed PRs.")
+    ap.add_argument("--max-cache-age-days", type=float, default=MAX_CACHE_AGE_DAYS,
+                    help="Refetch cached PR listing pages older than this (file contents never expire).")
+    args = ap.parse_args()
+
+    open_disk_cache(CACHE_PATH, args.max_cache_age_days)
     token = load_token(TOKEN_PATH)
-    gh = Github(token)
+    gh = Github(
+        token,
+        pool_size=PARALLEL_PRS * FILE_PREFETCH_WORKERS,
+        seconds_between_requests=SECONDS_BETWEEN_REQUESTS,
+    )
     repos_meta = load_repo_list(REPO_LIST_PATH)
 
     os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    with open(OUTPUT_PATH, "a", encoding="utf-8") as fout:
+    with open(OUTPUT_PATH, "ab", buffering=1 << 20) as fout:
         total = 0
         for repo_rec in repos_meta:
             full_name = repo_rec["full_name"]
@@ -401,13 +955,17 @@ def main():
 
             repo_examples = collect_examples_from_repo_time_order(
                 gh,
+                token,
                 repo_full_name=full_name,
                 max_examples_per_repo=MAX_EXAMPLES_PER_REPO,
                 max_prs_to_scan=MAX_PRS_TO_SCAN,
             )
 
+            # file contents are only reused within a repo; drop them to bound memory
+            clear_file_cache()
+
             for ex in repo_examples:
-                fout.write(json.dumps(ex, ensure_ascii=False) + "\n")
+                fout.write(dump_jsonl_line(ex))
             fout.flush()
 
             print(f"[write] wrote {len(repo_examples)} examples from {full_name}", flush=True)
@@ -415,6 +973,8 @@ def main():
 
         print(f"[TOTAL] {total} examples overall", flush=True)
 
+    close_disk_cache()
+
 
 if __name__ == "__main__":
     main()
@@ -1,29 +1,33 @@
 import json
 import argparse
 from pathlib import Path
-from typing import List, Dict
+from textwrap import indent
+from typing import Dict, Iterable, Iterator
+
+try:
+    import orjson  # optional: faster per-line decoding
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
 # Input and output paths
 DEFAULT_IN_PATH = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\data\generated_reviews.jsonl"
 DEFAULT_OUT_PATH = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\data\formatted_comments.json"
 
 
-def load_jsonl(path: str) -> List[Dict]:
-    data = []
+def load_jsonl(path: str) -> Iterator[Dict]:
     with open(path, "r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
             try:
-                data.append(json.loads(line))
+                yield _loads(line)
             except Exception:
                 continue
-    return data
 
 
-def format_comments(records: List[Dict]) -> List[Dict]:
-    formatted = []
+def format_comments(records: Iterable[Dict]) -> Iterator[Dict]:
     for rec in records:
         if rec.get("parse_fail"):
             continue
@@ -32,32 +36,52 @@ def format_comments(records: List[Dict]) -> List[Dict]:
         comment = rec.get("generated_comment")
         if not (file_path and line and comment):
             continue
-        formatted.append({
+        yield {
             "path": file_path,
             "line": int(line),
             "body": comment.strip(),
             "side": "RIGHT"
-        })
-    return formatted
+        }
+
+
+def write_json_array(f, items: Iterable[Dict], pretty: bool = False) -> int:
+    """
+    Stream items as one JSON array (same text json.dump would produce) without
+    holding them all in memory. Returns the number of items written.
+    """
+    count = 0
+    for item in items:
+        if pretty:
+            f.write("[\n" if count == 0 else ",\n")
+            f.write(indent(json.dumps(item, ensure_ascii=False, indent=2), "  "))
+        else:
+            f.write("[" if count == 0 else ", ")
+            f.write(json.dumps(item, ensure_ascii=False))
+        count += 1
+    if count == 0:
+        f.write("[]")
+    else:
+        f.write("\n]" if pretty else "]")
+    return count
 
 
 def main():
     ap = argparse.ArgumentParser(description="Format generated review comments for CI integration.")
     ap.add_argument("--infile", type=str, default=DEFAULT_IN_PATH, help="Input JSONL file (from generator).")
     ap.add_argument("--outfile", type=str, default=DEFAULT_OUT_PATH, help="Output JSON file (CI-ready).")
+    ap.add_argument("--pretty", action="store_true", help="Indent the output JSON (slower on large batches).")
     args = ap.parse_args()
 
     if not Path(args.infile).exists():
         print(f"[ERROR] Input file not found: {args.infile}")
         return
 
-    data = load_jsonl(args.infile)
-    formatted = format_comments(data)
+    formatted = format_comments(load_jsonl(args.infile))
 
     with open(args.outfile, "w", encoding="utf-8") as f:
-        json.dump(formatted, f, ensure_ascii=False, indent=2)
+        count = write_json_array(f, formatted, pretty=args.pretty)
 
-    print(f"[DONE] Formatted {len(formatted)} comments → {args.outfile}")
+    print(f"[DONE] Formatted {count} comments → {args.outfile}")
 
 
 if __name__ == "__main__":
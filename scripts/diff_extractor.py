@@ -2,13 +2,55 @@ import sys
 import json
 import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_BASE = "https://api.github.com"
 TOKEN_PATH = "github_token.txt"
+PAGE_WORKERS = 8         # concurrent requests for the remaining PR file pages
+
+# One pooled keep-alive session for all API calls; transient errors are retried with backoff.
+SESSION = requests.Session()
+SESSION.headers.update({
+    "Accept": "application/vnd.github+json",
+    "User-Agent": "LiteReviewer/1.0",
+})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=5, backoff_factor=1, status_forcelist=[429, 502, 503, 504], raise_on_status=False),
+))
 
 HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
 
+def _parse_range(tok: str, sign: str) -> tuple[int, int]:
+    # "-12,3" -> (12, 3); a missing length means 1
+    if tok[:1] != sign:
+        raise ValueError(tok)
+    start, comma, length = tok[1:].partition(",")
+    if not start.isdecimal() or (comma and not length.isdecimal()):
+        raise ValueError(tok)
+    return int(start), int(length) if comma else 1
+
+def parse_hunk_header(header_line: str) -> tuple[int, int, int, int] | None:
+    """
+    (old_start, old_len, new_start, new_len) from "@@ -a[,b] +c[,d] @@ ...", or None.
+    Split-based fast path; anything it doesn't recognise goes through HUNK_RE.
+    """
+    try:
+        at, minus, plus, rest = header_line.split(" ", 3)
+        if at != "@@" or not rest.startswith("@@"):
+            raise ValueError(header_line)
+        return (*_parse_range(minus, "-"), *_parse_range(plus, "+"))
+    except ValueError:
+        m = HUNK_RE.match(header_line)
+        if not m:
+            return None
+        return int(m.group(1)), int(m.group(2) or "1"), int(m.group(3)), int(m.group(4) or "1")
+
 def load_token() -> str | None:
     p = Path(TOKEN_PATH)
     if p.exists():
@@ -16,34 +58,41 @@ def load_token() -> str | None:
     return None
 
 def gh_get(url: str, token: str | None, params=None):
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "User-Agent": "LiteReviewer/1.0",
-    }
+    headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
-    r = requests.get(url, headers=headers, params=params, timeout=30)
+    r = SESSION.get(url, headers=headers, params=params, timeout=30)
     r.raise_for_status()
     return r
 
+def _last_page(r) -> int:
+    """Page number of the rel="last" Link header, or 1 when there is no further page."""
+    last = r.links.get("last")
+    if not last:
+        return 1
+    return int(parse_qs(urlparse(last["url"]).query).get("page", ["1"])[0])
+
 def list_pr_files(owner: str, repo: str, pr_number: int, token: str | None):
-    """Iterate all files in a PR (handles pagination)."""
-    page = 1
+    """
+    Iterate all files in a PR (handles pagination). The first page's Link header
+    gives the page count, so the remaining pages are fetched concurrently and
+    yielded in order.
+    """
+    url = f"{API_BASE}/repos/{owner}/{repo}/pulls/{pr_number}/files"
     per_page = 100
-    while True:
-        r = gh_get(
-            f"{API_BASE}/repos/{owner}/{repo}/pulls/{pr_number}/files",
-            token,
-            params={"page": page, "per_page": per_page},
-        )
-        items = r.json()
-        if not items:
-            break
-        for it in items:
-            yield it
-        if len(items) < per_page:
-            break
-        page += 1
+
+    def fetch_page(page: int):
+        return gh_get(url, token, params={"page": page, "per_page": per_page}).json()
+
+    first = gh_get(url, token, params={"page": 1, "per_page": per_page})
+    items = first.json()
+    yield from items
+    last = _last_page(first)
+    if last <= 1 or len(items) < per_page:
+        return
+    with ThreadPoolExecutor(max_workers=min(PAGE_WORKERS, last - 1)) as ex:
+        for page_items in ex.map(fetch_page, range(2, last + 1)):
+            yield from page_items
 
 def parse_diff_hunk(diff_text: str):
     """
@@ -65,39 +114,28 @@ def parse_diff_hunk(diff_text: str):
     if header_idx is None:
         return None
 
-    m = HUNK_RE.match(header_line.strip())
-    if not m:
+    header = parse_hunk_header(header_line.strip())
+    if header is None:
         return None
-
-    old_start = int(m.group(1))
-    old_len = int(m.group(2) or "1")
-    new_start = int(m.group(3))
-    new_len = int(m.group(4) or "1")
+    old_start, old_len, new_start, new_len = header
 
     out_lines = []
+    append = out_lines.append
     old_no = old_start
     new_no = new_start
 
     for raw in lines[header_idx + 1:]:
-        if not raw:
-            # treat as context (empty line), but unified diff usually has a leading ' ' on contexts
-            out_lines.append({"tag": " ", "text": "", "old": old_no, "new": new_no})
-            old_no += 1
-            new_no += 1
-            continue
-
-        tag = raw[0]
-        text = raw[1:] if tag in "+- " else raw
-
+        tag = raw[:1]
         if tag == "+":
-            out_lines.append({"tag": "+", "text": text, "old": None, "new": new_no})
+            append({"tag": "+", "text": raw[1:], "old": None, "new": new_no})
             new_no += 1
         elif tag == "-":
-            out_lines.append({"tag": "-", "text": text, "old": old_no, "new": None})
+            append({"tag": "-", "text": raw[1:], "old": old_no, "new": None})
             old_no += 1
         else:
-            # context
-            out_lines.append({"tag": " ", "text": text, "old": old_no, "new": new_no})
+            # context; an empty line (no leading ' ') is treated as empty context
+            text = raw[1:] if tag == " " else raw
+            append({"tag": " ", "text": text, "old": old_no, "new": new_no})
             old_no += 1
             new_no += 1
 
@@ -134,47 +172,71 @@ def build_unified_position_table(patch: str):
     Build a mapping of new-file line -> unified diff position index (1-based positions as GitHub expects).
     The 'position' is the index of the line within the *file's* patch across all hunks.
     We count every line in the patch after each hunk header as a position step.
+    Single pass over the patch, kept in step with split_hunks + parse_diff_hunk: lines under a
+    malformed header are skipped, and so is a bare empty line closing a hunk (split_hunks drops it).
     """
     if not patch:
         return {}
 
     pos_table = {}  # new_line_no -> unified position
     pos = 0
-    for hunk_text in split_hunks(patch):
-        lines = hunk_text.splitlines()
-        # first line is header; positions start after header
-        for i, raw in enumerate(lines):
-            if i == 0:
-                continue
-            pos += 1
-            tag = raw[0] if raw else " "
-            if tag == "+" or tag == " ":
-                # compute the new line number while walking
-                # we need to simulate like in parse_diff_hunk
-                # simpler: re-parse hunk and then re-count with alignment
-                pass
-
-    # The above naive approach isn't enough to know new line per position.
-    # Instead, properly parse each hunk and advance a running 'pos' counter in sync.
-
-    pos_table.clear()
-    pos = 0
-    for hunk_text in split_hunks(patch):
-        parsed = parse_diff_hunk(hunk_text)
-        if not parsed:
+    new_no = 0
+    in_hunk = False
+    lines = patch.splitlines()
+    last = len(lines) - 1
+    for i, raw in enumerate(lines):
+        if raw.startswith("@@"):
+            header = parse_hunk_header(raw.strip())
+            in_hunk = header is not None
+            if in_hunk:
+                new_no = header[2]
+            continue
+        if not in_hunk:
             continue
-        # iterate hunk body; each body line increments position
-        for ln in parsed["lines"]:
-            pos += 1
-            if ln["tag"] in ("+", " "):
-                new_no = ln["new"]
-                if new_no is not None and new_no not in pos_table:
-                    pos_table[new_no] = pos
+        if not raw and (i == last or lines[i + 1].startswith("@@")):
+            continue
+        pos += 1
+        tag = raw[:1]
+        if tag == "-":
+            continue
+        # '+' and context lines (including bare empty lines) map to a new-file line
+        pos_table.setdefault(new_no, pos)
+        new_no += 1
     return pos_table
 
+def build_file_info(f: dict):
+    """Parse one entry of the PR files listing into the per-file record yielded by extract_pr_diffs."""
+    path = f.get("filename")
+    status = f.get("status")
+    prev = f.get("previous_filename")
+    patch = f.get("patch")  # None for binary or move-only
+
+    if not patch:
+        return {
+            "path": path,
+            "status": status,
+            "previous_filename": prev,
+            "patch": None,
+            "hunks": [],
+            "position_table": {},
+        }
+
+    hunks_raw = split_hunks(patch)
+    hunks_parsed = [h for h in (parse_diff_hunk(hh) for hh in hunks_raw) if h]
+    pos_table = build_unified_position_table(patch)
+
+    return {
+        "path": path,
+        "status": status,
+        "previous_filename": prev,
+        "patch": patch,
+        "hunks": hunks_parsed,
+        "position_table": pos_table,
+    }
+
 def extract_pr_diffs(owner: str, repo: str, pr_number: int, token: str | None):
     """
-    Yield per-file diff info:
+    Yield per-file diff info, in the order GitHub lists the files:
     {
       "path": str,
       "status": "modified|added|removed|renamed|...",
@@ -184,35 +246,7 @@ def extract_pr_diffs(owner: str, repo: str, pr_number: int, token: str | None):
       "position_table": { new_line -> position }
     }
     """
-    for f in list_pr_files(owner, repo, pr_number, token):
-        path = f.get("filename")
-        status = f.get("status")
-        prev = f.get("previous_filename")
-        patch = f.get("patch")  # None for binary or move-only
-
-        if not patch:
-            yield {
-                "path": path,
-                "status": status,
-                "previous_filename": prev,
-                "patch": None,
-                "hunks": [],
-                "position_table": {},
-            }
-            continue
-
-        hunks_raw = split_hunks(patch)
-        hunks_parsed = [h for h in (parse_diff_hunk(hh) for hh in hunks_raw) if h]
-        pos_table = build_unified_position_table(patch)
-
-        yield {
-            "path": path,
-            "status": status,
-            "previous_filename": prev,
-            "patch": patch,
-            "hunks": hunks_parsed,
-            "position_table": pos_table,
-        }
+    yield from map(build_file_info, list_pr_files(owner, repo, pr_number, token))
 
 def main():
     if len(sys.argv) != 3:
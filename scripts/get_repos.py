@@ -1,51 +1,115 @@
-from github import Github
 import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+SEARCH_QUERY = "language:Python sort:stars-desc"
+SEARCH_OFFSET = 500    # skip the very top repos
+SEARCH_LIMIT = 1500    # GitHub search stops at 1000 results anyway
+PAGE_SIZE = 50
+
+# Stars, fork/language flags and the PR/contributor counts all come back with
+# the search page itself, so there is no per-repo follow-up request.
+# mentionableUsers stands in for the REST contributor count (GraphQL has no
+# contributors connection).
+REPO_SEARCH_QUERY = """
+query($q: String!, $first: Int!, $after: String) {
+  search(query: $q, type: REPOSITORY, first: $first, after: $after) {
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      ... on Repository {
+        nameWithOwner
+        stargazerCount
+        isFork
+        primaryLanguage { name }
+        pullRequests { totalCount }
+        mentionableUsers { totalCount }
+      }
+    }
+  }
+}
+"""
 
 # read your token
 with open("github_token.txt", "r", encoding="utf-8") as f:
     token = f.read().strip()
 
-g = Github(token)
+session = requests.Session()
+session.headers["Authorization"] = f"Bearer {token}"
+# search is read-only, so POST is retried on transient 5xx and (secondary) rate limits
+session.mount("https://", HTTPAdapter(
+    max_retries=Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[403, 429, 502, 503, 504],
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+))
+
+
+def run_query(variables):
+    r = session.post(GRAPHQL_URL, json={"query": REPO_SEARCH_QUERY, "variables": variables}, timeout=60)
+    r.raise_for_status()
+    payload = r.json()
+    # search often returns partial errors (e.g. one repo's count timed out) next to
+    # valid data; the affected nodes/fields come back null and are skipped below
+    if payload.get("errors"):
+        print(f"[WARN] GraphQL errors: {payload['errors']}")
+    search = (payload.get("data") or {}).get("search")
+    if search is None:
+        raise RuntimeError(f"GraphQL error: {payload.get('errors')}")
+    return search
+
 
 results = []
 
 # 1. search for top Python repos by stars
 #    we'll overfetch (like top 100) then filter
-query = 'language:Python sort:stars'
-repos = g.search_repositories(query=query)  # already sorted by stars desc
-
-for repo in repos[500:1500]:
-    print(f"Processing repo: {repo.full_name} with {repo.stargazers_count} stars")
+seen = 0
+cursor = None
+while seen < SEARCH_LIMIT:
     try:
+        page = run_query({"q": SEARCH_QUERY, "first": PAGE_SIZE, "after": cursor})
+    except (requests.RequestException, RuntimeError) as e:
+        # keep what was collected so far instead of losing the whole scan
+        print(f"[WARN] search page failed after retries, stopping: {e}")
+        break
+    for repo in page.get("nodes") or []:
+        seen += 1
+        if seen <= SEARCH_OFFSET or seen > SEARCH_LIMIT:
+            continue
+        if not repo:
+            continue
+        print(f"Processing repo: {repo['nameWithOwner']} with {repo['stargazerCount']} stars")
+
         # skip forks
-        if repo.fork:
+        if repo["isFork"]:
             continue
 
         # primary language check
-        if (repo.language or "").lower() != "python":
+        if ((repo.get("primaryLanguage") or {}).get("name") or "").lower() != "python":
             continue
 
-        # count contributors
-        contributors = repo.get_contributors()
-        contributor_count = contributors.totalCount
-
-        # count PRs (open + closed)
-        pulls_open = repo.get_pulls(state="open").totalCount
-        pulls_closed = repo.get_pulls(state="closed").totalCount
-        total_prs = pulls_open + pulls_closed
+        if not repo.get("mentionableUsers") or not repo.get("pullRequests"):
+            print(f"[WARN] missing counts for {repo['nameWithOwner']}, skipping")
+            continue
+        contributor_count = repo["mentionableUsers"]["totalCount"]
+        total_prs = repo["pullRequests"]["totalCount"]  # open + closed + merged
 
         # apply thresholds
         if total_prs >= 1000 and contributor_count >= 50:
             results.append({
-                "full_name": repo.full_name,
-                "stars": repo.stargazers_count,
+                "full_name": repo["nameWithOwner"],
+                "stars": repo["stargazerCount"],
                 "total_prs": total_prs,
                 "contributors": contributor_count,
             })
 
-    except Exception as e:
-        # some repos may have perms/rate limit weirdness, just skip
-        continue
+    if not page["pageInfo"]["hasNextPage"]:
+        break
+    cursor = page["pageInfo"]["endCursor"]
 
 # sort the passing repos again by stars desc
 results_sorted = sorted(results, key=lambda r: r["stars"], reverse=True)
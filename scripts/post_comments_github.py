@@ -1,14 +1,74 @@
 import os
 import sys
 import json
+import pandas as pd
 import requests
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 GITHUB_API = "https://api.github.com"
+REQUEST_TIMEOUT = 30
+
+# Creating a review is not idempotent, so POST is only retried on responses where
+# GitHub did not process it (rate limited / unavailable), honouring Retry-After.
+SESSION = requests.Session()
+SESSION.headers.update({"Accept": "application/vnd.github+json"})
+SESSION.mount("https://", HTTPAdapter(
+    max_retries=Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 503],
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+))
 
 # Default paths (change if you want)
 DEFAULT_REVIEWS_PATH = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\data\generated_reviews.jsonl"
 
+SPAN_COLUMNS = ["new_start", "new_len", "old_start", "old_len"]
+SINGLE_LINE_KEYS = ("path", "line", "side", "body")
+
+
+def _int_column(col):
+    # same rule as isinstance(v, int) per value; anything else becomes <NA>
+    return col.where(col.map(lambda v: isinstance(v, int))).astype("Int64")
+
+
+def build_comments_payload(rows):
+    """
+    Build multi-line review comments, one per hunk row, in row order.
+    Prefers the added side of the hunk, otherwise the deleted side; rows with
+    neither span are reported and skipped. Spans of one line use the single-line form.
+    """
+    # dtype=object keeps JSON ints as Python ints instead of widening to float around nulls
+    df = pd.DataFrame(rows, columns=["file_path", "generated_comment", *SPAN_COLUMNS], dtype=object)
+    new_start, new_len, old_start, old_len = (_int_column(df[c]) for c in SPAN_COLUMNS)
+
+    mask_right = (new_start.notna() & (new_len > 0)).fillna(False).astype(bool)
+    mask_left = ~mask_right & (old_start.notna() & (old_len > 0)).fillna(False).astype(bool)
+    for path in df.loc[~(mask_right | mask_left), "file_path"]:
+        print(f"[SKIP] No valid hunk span for {path}")
+
+    comment = df["generated_comment"]
+    start_line = new_start.where(mask_right, old_start)
+    out = pd.DataFrame({
+        "path": df["file_path"],
+        "start_line": start_line,
+        "start_side": pd.Series("LEFT", index=df.index).where(~mask_right, "RIGHT"),
+        "line": start_line + new_len.where(mask_right, old_len) - 1,
+        "body": comment.where(comment.notna() & (comment != ""), "Looks good to me."),
+    })[mask_right | mask_left]
+    out.insert(4, "side", out["start_side"])
+
+    # GitHub review API: if the span is 1 line, use single-line form.
+    return [
+        {k: r[k] for k in SINGLE_LINE_KEYS} if r["start_line"] == r["line"] else r
+        for r in out.to_dict(orient="records")
+    ]
+
+
 def main():
     if len(sys.argv) < 3:
         print("Usage: python post_comments_github.py <repo> <pr_id> [reviews_path]")
@@ -50,54 +110,7 @@ def main():
         print("[INFO] Nothing to post.")
         return
 
-    # Build multi-line review comments; one per hunk row
-    comments_payload = []
-    for r in rows:
-        path = r["file_path"]
-        body = r.get("generated_comment") or "Looks good to me."
-        # Prefer additions; otherwise deletions
-        new_start = r.get("new_start")
-        new_len   = r.get("new_len")
-        old_start = r.get("old_start")
-        old_len   = r.get("old_len")
-
-        # Normalize ints
-        new_start = new_start if isinstance(new_start, int) else None
-        new_len   = new_len   if isinstance(new_len, int)   else None
-        old_start = old_start if isinstance(old_start, int) else None
-        old_len   = old_len   if isinstance(old_len, int)   else None
-
-        # Decide side and range
-        if new_start is not None and new_len is not None and new_len > 0:
-            side = "RIGHT"
-            start_line = new_start
-            end_line   = new_start + new_len - 1
-        elif old_start is not None and old_len is not None and old_len > 0:
-            side = "LEFT"
-            start_line = old_start
-            end_line   = old_start + old_len - 1
-        else:
-            # Fallback: skip if we can’t derive a sensible span
-            print(f"[SKIP] No valid hunk span for {path}")
-            continue
-
-        # GitHub review API: if the span is 1 line, use single-line form.
-        if start_line == end_line:
-            comments_payload.append({
-                "path": path,
-                "line": start_line,
-                "side": side,
-                "body": body
-            })
-        else:
-            comments_payload.append({
-                "path": path,
-                "start_line": start_line,
-                "start_side": side,
-                "line": end_line,
-                "side": side,
-                "body": body
-            })
+    comments_payload = build_comments_payload(rows)
 
     if not comments_payload:
         print("[INFO] No comments to post after filtering.")
@@ -105,8 +118,7 @@ def main():
 
     # Create a single review with all comments (no commit_id/positions needed)
     url = f"{GITHUB_API}/repos/{repo}/pulls/{pr_id}/reviews"
-    headers = {"Authorization": f"token {os.environ['GITHUB_TOKEN']}",
-               "Accept": "application/vnd.github+json"}
+    headers = {"Authorization": f"token {os.environ['GITHUB_TOKEN']}"}
     payload = {
         "event": "COMMENT",
         "comments": comments_payload
@@ -114,7 +126,7 @@ def main():
     }
 
     print(f"[INFO] Posting {len(comments_payload)} hunk-wide comments as one review…")
-    r = requests.post(url, headers=headers, json=payload)
+    r = SESSION.post(url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
     if r.status_code not in (200, 201):
         print(f"[ERROR] Failed to create review: {r.status_code} {r.text}")
         sys.exit(1)
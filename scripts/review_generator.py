@@ -5,15 +5,30 @@ import re
 import time
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 
+try:
+    import orjson  # optional: faster decoding of the diff JSONL and encoding of the output rows
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
 # =================== CONFIG (adjust paths) ===================
 PROMPT_ZERO_PATH = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\prompts\zero_shot.json"
 PROMPT_FEW_PATH  = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\prompts\few_shot.json"
 OLLAMA_URL       = "http://127.0.0.1:11434/api/generate"
 DEFAULT_OUT_PATH = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\data\generated_reviews.jsonl"
 DEFAULT_TIMEOUT  = 180
+# In-flight requests. Requests beyond the server's OLLAMA_NUM_PARALLEL wait in its queue
+# on the same --timeout clock, so raise this only together with that setting.
+DEFAULT_WORKERS  = 1
+FLUSH_EVERY      = 100  # output rows between explicit flushes
 
 MODEL_MAP = {
     "phi": "phi3:mini",
@@ -22,9 +37,26 @@ MODEL_MAP = {
 }
 # ============================================================
 
+# One keep-alive session for all Ollama calls; the pool covers the concurrent --workers.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+
+def dump_jsonl_line(obj) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj) + b"\n"
+        except orjson.JSONEncodeError:
+            pass  # e.g. a model-supplied "line" beyond 64 bits; json handles any int
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
 
 # ---------- Robust JSON Parser Utilities ----------
-ALLOWED_TYPES = {"STYLE", "LOGIC", "DOCUMENTATION", "SECURITY", "PERFORMANCE", "OTHER"}
+ALLOWED_TYPES = frozenset({"STYLE", "LOGIC", "DOCUMENTATION", "SECURITY", "PERFORMANCE", "OTHER"})
+# A '"type' that isn't a proper '"type"' key swallowed the rest of its object: everything
+# up to the next '}' (or, with no '}' left, up to the last character) becomes the comment.
+# A proper '"type"' or a trailing '"type' is matched too, so it is skipped as a whole.
+_FIX_RE = re.compile(r'"type(?:"|\Z|([^}]*)(?=})|([^}]*)(?=[^}]\Z))')
 
 def _strip_code_fences(s: str) -> str:
     s = s.strip()
@@ -44,46 +76,27 @@ def _isolate_first_json_array(s: str) -> str:
         return s[start:]
     return s[start:end+1]
 
+def _fix_type_concat_repl(m: re.Match) -> str:
+    if m.lastindex is None:
+        return m.group(0)  # '"type"' key or '"type' at the very end: leave as is
+    return '"type": "OTHER", "comment": ' + json.dumps(m.group(m.lastindex).strip())
+
 def _fix_type_concat_bug(s: str) -> str:
-    out = []
-    i = 0
-    while i < len(s):
-        j = s.find('"type', i)
-        if j == -1:
-            out.append(s[i:])
-            break
-
-        out.append(s[i:j])
-        k = j + len('"type')
-        if k < len(s) and s[k] != '"':
-            end_candidates = []
-            for pat in [r'}\s*,', r'}\s*\]?', r'}\s*\n']:
-                m = re.search(pat, s[k:], flags=re.DOTALL)
-                if m:
-                    end_candidates.append(k + m.start())
-            obj_end = min(end_candidates) if end_candidates else len(s)-1
-            accidental = s[k:obj_end].strip()
-            replacement = '"type": "OTHER", "comment": ' + json.dumps(accidental)
-            out.append(replacement)
-            i = obj_end
-            continue
-        else:
-            out.append(s[j:j+6])  # '"type"'
-            i = j + 6
-    return "".join(out)
+    return _FIX_RE.sub(_fix_type_concat_repl, s)
 
 def _normalize_types(objs: List[Dict]) -> List[Dict]:
     norm = []
     for o in objs:
-        line = o.get("line")
-        comment = o.get("comment")
-        ctype = o.get("type", "OTHER")
+        get = o.get
+        ctype = get("type", "OTHER")
         if isinstance(ctype, str):
-            ctype_up = ctype.strip().upper()
-            ctype = ctype_up if ctype_up in ALLOWED_TYPES else "OTHER"
+            # already-canonical types skip the strip/upper copy
+            if ctype not in ALLOWED_TYPES:
+                ctype_up = ctype.strip().upper()
+                ctype = ctype_up if ctype_up in ALLOWED_TYPES else "OTHER"
         else:
             ctype = "OTHER"
-        norm.append({"line": line, "type": ctype, "comment": comment})
+        norm.append({"line": get("line"), "type": ctype, "comment": get("comment")})
     return norm
 
 def parse_model_json_strict(raw: str) -> Tuple[List[Dict], bool]:
@@ -105,6 +118,10 @@ def parse_model_json_strict(raw: str) -> Tuple[List[Dict], bool]:
     except Exception:
         pass
 
+    # the fix only rewrites '"type' keys; without one it would return s unchanged
+    if '"type' not in s:
+        return [], True
+
     s2 = _fix_type_concat_bug(s)
     try:
         data = json.loads(s2)
@@ -117,22 +134,37 @@ def parse_model_json_strict(raw: str) -> Tuple[List[Dict], bool]:
 # -------------------------------------------------
 
 
-def load_prompt_text(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        obj = json.load(f)
-    if isinstance(obj, dict) and "prompt" in obj:
-        return obj["prompt"]
-    raise ValueError(f"Prompt file must be a JSON object with key 'prompt': {path}")
+def split_prompt_template(template: str) -> Optional[Tuple[str, str, str]]:
+    """(pre, mid, post) around one {{context}} followed by one {{diff_hunk}}; None for any other layout."""
+    if template.count("{{context}}") != 1 or template.count("{{diff_hunk}}") != 1:
+        return None
+    pre, rest = template.split("{{context}}", 1)
+    if "{{diff_hunk}}" not in rest:
+        return None
+    mid, post = rest.split("{{diff_hunk}}", 1)
+    return pre, mid, post
 
 
-def fill_prompt(template: str, context: str, diff_hunk: str) -> str:
-    return template.replace("{{context}}", context or "").replace("{{diff_hunk}}", diff_hunk or "")
+@lru_cache(maxsize=4)
+def load_prompt_text(path: str) -> Tuple[str, str, str]:
+    """
+    Load a prompt template, already split into (pre, mid, post) so a prompt is
+    "".join((pre, context, mid, diff_hunk, post)).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        obj = json.load(f)
+    if not (isinstance(obj, dict) and "prompt" in obj):
+        raise ValueError(f"Prompt file must be a JSON object with key 'prompt': {path}")
+    parts = split_prompt_template(obj["prompt"])
+    if parts is None:
+        raise ValueError(f"Prompt must contain '{{{{context}}}}' then '{{{{diff_hunk}}}}', once each: {path}")
+    return parts
 
 
 def ask_ollama(prompt: str, model: str, timeout_s: int = DEFAULT_TIMEOUT) -> str:
     def _call(opts):
         payload = {"model": model, "prompt": prompt, "options": opts, "stream": False}
-        r = requests.post(OLLAMA_URL, json=payload, timeout=timeout_s)
+        r = SESSION.post(OLLAMA_URL, json=payload, timeout=timeout_s)
         data = r.json()
         if r.status_code >= 400 or "error" in data:
             raise RuntimeError(f"Ollama error ({r.status_code}): {data.get('error') or data}")
@@ -153,29 +185,30 @@ def ask_ollama(prompt: str, model: str, timeout_s: int = DEFAULT_TIMEOUT) -> str
 
 
 def build_context_from_hunk(hunk: Dict[str, Any], max_lines: int = 200) -> str:
-    neutral = []
+    # keep only the first half and a rolling window of the last half of the context lines,
+    # so memory stays O(max_lines) however large the hunk is
+    head_cap = max_lines // 2
+    head = []
+    tail = deque(maxlen=(max_lines - head_cap) or None)  # max_lines == 0 keeps every line after "..."
+    total = 0
     for entry in hunk.get("lines", []):
-        tag = entry.get("tag")
-        text = entry.get("text", "")
-        if tag == " ":
-            neutral.append(text)
-    if len(neutral) > max_lines:
-        head = neutral[: max_lines // 2]
-        tail = neutral[-(max_lines - len(head)) :]
-        return "\n".join(head + ["..."] + tail)
-    return "\n".join(neutral)
+        if entry.get("tag") == " ":
+            text = entry.get("text", "")
+            if len(head) < head_cap:
+                head.append(text)
+            else:
+                tail.append(text)
+            total += 1
+    if total > max_lines:
+        return "\n".join(head + ["..."] + list(tail))
+    return "\n".join(head + list(tail))
 
 
 def build_diff_from_hunk(hunk: Dict[str, Any]) -> str:
     header = hunk.get("header") or f"@@ -{hunk.get('old_start', '?')},{hunk.get('old_len', '?')} +{hunk.get('new_start', '?')},{hunk.get('new_len', '?')} @@"
     out = [header]
-    for entry in hunk.get("lines", []):
-        tag = entry.get("tag")
-        text = entry.get("text", "")
-        if tag == "+":
-            out.append("+" + text)
-        elif tag == "-":
-            out.append("-" + text)
+    # only +/- lines are shown to the model; each is one concat of tag and text
+    out.extend([tag + entry.get("text", "") for entry in hunk.get("lines", []) if (tag := entry.get("tag")) in ("+", "-")])
     return "\n".join(out)
 
 
@@ -194,11 +227,17 @@ def absolute_new_line(hunk: dict, approx_line: object) -> int | None:
 
     lines = hunk.get("lines") or []
     new_start = hunk.get("new_start")
-    new_len   = hunk.get("new_len")
-    new_end   = (new_start + max(0, new_len) - 1) if isinstance(new_start, int) and isinstance(new_len, int) else None
 
-    # Build +/- list (what the model saw in the prompt)
-    plus_minus = [(i, e) for i, e in enumerate(lines) if e.get("tag") in {"+", "-"}]
+    # +/- list (what the model saw in the prompt) and new_end depend only on the hunk,
+    # so they are computed on first use and kept on the hunk dict
+    cached = hunk.get("_line_map")
+    if cached is None:
+        new_len = hunk.get("new_len")
+        new_end = (new_start + max(0, new_len) - 1) if isinstance(new_start, int) and isinstance(new_len, int) else None
+        plus_minus = [(i, e) for i, e in enumerate(lines) if e.get("tag") in ("+", "-")]
+        hunk["_line_map"] = (plus_minus, new_end)
+    else:
+        plus_minus, new_end = cached
 
     def new_if_add(e: dict) -> int | None:
         return e.get("new") if e.get("tag") == "+" and isinstance(e.get("new"), int) else None
@@ -277,6 +316,28 @@ def process_diff_line(
     }
 
 
+def iter_hunks(fin, max_hunks: int = 0):
+    """Yield (file_path, hunk_index, hunk) from diff_extractor JSONL lines, stopping after max_hunks (0 = all)."""
+    count = 0
+    for line in fin:
+        # both decoders take bytes and ignore the trailing newline; blank lines fail to parse
+        try:
+            rec = _loads(line)
+        except Exception:
+            continue
+
+        file_path = rec.get("path")
+        hunks = rec.get("hunks") or []
+        if not file_path or not hunks:
+            continue
+
+        for h_idx, hunk in enumerate(hunks):
+            if max_hunks and count >= max_hunks:
+                return
+            count += 1
+            yield file_path, h_idx, hunk
+
+
 def main():
     ap = argparse.ArgumentParser(description="Generate review comments from diff_extractor output using Ollama SLMs.")
     ap.add_argument("repo", type=str, help="Repo full name, e.g. localstack/localstack")
@@ -287,12 +348,17 @@ def main():
     ap.add_argument("--out", type=str, default=DEFAULT_OUT_PATH, help="Output JSONL path")
     ap.add_argument("--max", type=int, default=0, help="Max hunks to process (0 = all)")
     ap.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="Ollama request timeout (s)")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                    help="Concurrent Ollama requests (match the server's OLLAMA_NUM_PARALLEL; "
+                         "queued requests count against --timeout)")
     args = ap.parse_args()
+    if args.workers < 1:
+        ap.error("--workers must be >= 1")
 
     model_name = MODEL_MAP[args.model]
     shot_name = "few" if args.shot == 1 else "zero"
     prompt_path = PROMPT_FEW_PATH if args.shot == 1 else PROMPT_ZERO_PATH
-    prompt_template = load_prompt_text(prompt_path)
+    pre, mid, post = load_prompt_text(prompt_path)
 
     diff_path = Path(args.diff_jsonl)
     if not diff_path.exists():
@@ -307,96 +373,87 @@ def main():
     processed = written = 0
     os.makedirs(Path(args.out).parent, exist_ok=True)
 
-    with open(args.out, "a", encoding="utf-8") as fout, open(diff_path, "r", encoding="utf-8") as fin:
-        for line in fin:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                rec = json.loads(line)
-            except Exception:
-                continue
-
-            file_path = rec.get("path")
-            hunks = rec.get("hunks") or []
-            if not file_path or not hunks:
-                continue
-
-            for h_idx, hunk in enumerate(hunks):
-                if args.max and processed >= args.max:
-                    break
-
-                context = build_context_from_hunk(hunk)
-                diff_txt = build_diff_from_hunk(hunk)
-                prompt = fill_prompt(prompt_template, context, diff_txt)
-
-                print(f"[HUNK] {file_path} | hunk {h_idx} | chars(context)={len(context)} chars(diff)={len(diff_txt)}")
-
-                try:
-                    raw = ask_ollama(prompt, model_name, timeout_s=args.timeout)
-                except Exception as e:
-                    fail_row = {
-                        "repo": args.repo,
-                        "pr_id": args.pr,
-                        "file_path": file_path,
-                        "hunk_index": h_idx,
-                        "model": model_name,
-                        "shot": shot_name,
-                        "parse_fail": True,
-                        "error": str(e),
-                        "raw": None,
-                        "ts": int(time.time()),
-                    }
-                    fout.write(json.dumps(fail_row, ensure_ascii=False) + "\n")
-                    written += 1
-                    processed += 1
-                    continue
-
-                parsed, parse_fail = parse_model_json_strict(raw)
-                if parse_fail:
-                    fail_row = {
-                        "repo": args.repo,
-                        "pr_id": args.pr,
-                        "file_path": file_path,
-                        "hunk_index": h_idx,
-                        "model": model_name,
-                        "shot": shot_name,
-                        "parse_fail": True,
-                        "raw": raw,
-                        "ts": int(time.time()),
-                    }
-                    fout.write(json.dumps(fail_row, ensure_ascii=False) + "\n")
-                    written += 1
-                else:
-                    # --- Filter multiple comments per hunk ---
-                    filtered = [p for p in parsed if p.get("comment") and "looks good" not in p["comment"].lower()]
-                    if not filtered:
-                        # If all were trivial, just keep the first
-                        filtered = parsed[:1]
-                    else:
-                        # Keep the longest informative one
-                        filtered = [max(filtered, key=lambda x: len(x.get("comment", "")))]
-
-                    # --- Write only one final record ---
-                    item = filtered[0]
-                    row = process_diff_line(
-                        item,
-                        repo=args.repo,
-                        pr=args.pr,
-                        file_path=file_path,
-                        model_name=model_name,
-                        shot=shot_name,
-                        hunk_idx=h_idx,
-                        hunk=hunk,
-                        prompt_used=prompt,
-                    )
-                    fout.write(json.dumps(row, ensure_ascii=False) + "\n")
-                    written += 1
-
-
-                processed += 1
-            if args.max and processed >= args.max:
-                break
+    def hunk_row(file_path, h_idx, hunk, prompt, future):
+        try:
+            raw = future.result()
+        except Exception as e:
+            return {
+                "repo": args.repo,
+                "pr_id": args.pr,
+                "file_path": file_path,
+                "hunk_index": h_idx,
+                "model": model_name,
+                "shot": shot_name,
+                "parse_fail": True,
+                "error": str(e),
+                "raw": None,
+                "ts": int(time.time()),
+            }
+
+        parsed, parse_fail = parse_model_json_strict(raw)
+        if parse_fail:
+            return {
+                "repo": args.repo,
+                "pr_id": args.pr,
+                "file_path": file_path,
+                "hunk_index": h_idx,
+                "model": model_name,
+                "shot": shot_name,
+                "parse_fail": True,
+                "raw": raw,
+                "ts": int(time.time()),
+            }
+
+        # --- Filter multiple comments per hunk ---
+        filtered = [p for p in parsed if p.get("comment") and "looks good" not in p["comment"].lower()]
+        if not filtered:
+            # If all were trivial, just keep the first
+            filtered = parsed[:1]
+        else:
+            # Keep the longest informative one
+            filtered = [max(filtered, key=lambda x: len(x.get("comment", "")))]
+
+        # --- Write only one final record ---
+        item = filtered[0]
+        return process_diff_line(
+            item,
+            repo=args.repo,
+            pr=args.pr,
+            file_path=file_path,
+            model_name=model_name,
+            shot=shot_name,
+            hunk_idx=h_idx,
+            hunk=hunk,
+            prompt_used=prompt,
+        )
+
+    def write_row(fout, row):
+        nonlocal processed, written
+        fout.write(dump_jsonl_line(row))
+        written += 1
+        processed += 1
+        if written % FLUSH_EVERY == 0:
+            fout.flush()  # bound what a crash can lose without a syscall per row
+
+    # Up to --workers hunks are in flight to Ollama at once; rows are written in input order.
+    with open(args.out, "ab", buffering=1 << 20) as fout, open(diff_path, "rb") as fin, \
+            ThreadPoolExecutor(max_workers=args.workers) as ex:
+        pending = deque()
+        for file_path, h_idx, hunk in iter_hunks(fin, args.max):
+            context = build_context_from_hunk(hunk)
+            diff_txt = build_diff_from_hunk(hunk)
+            prompt = "".join((pre, context, mid, diff_txt, post))
+
+            print(f"[HUNK] {file_path} | hunk {h_idx} | chars(context)={len(context)} chars(diff)={len(diff_txt)}")
+
+            future = ex.submit(ask_ollama, prompt, model_name, args.timeout)
+            pending.append((file_path, h_idx, hunk, prompt, future))
+            # keep the queue a little ahead of the workers without holding every prompt
+            while len(pending) > 2 * args.workers or (pending and pending[0][-1].done()):
+                write_row(fout, hunk_row(*pending.popleft()))
+
+        while pending:
+            write_row(fout, hunk_row(*pending.popleft()))
 
     print(f"\n[DONE] hunks processed: {processed} | rows written: {written} | out: {args.out}")
 
@@ -1,5 +1,6 @@
 import ast
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from importlib import metadata
 
@@ -8,100 +9,141 @@ from importlib import metadata
 # Change this if you want to scan a different folder
 PROJECT_ROOT = Path(__file__).resolve().parent.parent  # repo root (.. from tools/)
 EXCLUDE_DIRS = {"venv", ".git", ".idea", ".vscode", "__pycache__"}
+PARALLEL_MIN_FILES = 64  # below this, parsing inline beats process-pool startup
 # -----------------------------
 
 
 def iter_python_files(root: Path):
-    """Yield all .py files under root, excluding EXCLUDE_DIRS."""
-    for dirpath, dirnames, filenames in os.walk(root):
-        # Skip excluded dirs
-        dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIRS]
+    """
+    Yield all .py files under root, excluding EXCLUDE_DIRS.
+    Uses os.scandir so file/dir checks come from the cached DirEntry data;
+    like os.walk, symlinked dirs are not descended and unreadable dirs are skipped.
+    """
+    try:
+        it = os.scandir(root)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            if entry.is_dir():
+                if entry.name not in EXCLUDE_DIRS and not entry.is_symlink():
+                    yield from iter_python_files(entry.path)
+            elif entry.name.endswith(".py"):
+                yield Path(entry.path)
 
-        for fname in filenames:
-            if fname.endswith(".py"):
-                yield Path(dirpath) / fname
 
+# statements whose bodies still run at import time; function and class bodies are not scanned
+_BLOCK_STMTS = tuple(getattr(ast, n) for n in ("If", "Try", "TryStar", "With") if hasattr(ast, n))
 
-def collect_imports(root: Path):
+
+def _iter_module_level_nodes(tree: ast.Module):
     """
-    Parse all .py files and collect top-level imported module names
-    (e.g. 'requests', 'torch', 'numpy').
+    Yield module-level statements, descending into if/try/with blocks
+    (e.g. `if TYPE_CHECKING:` or `try: import x except ImportError: ...`).
     """
+    stack = list(reversed(tree.body))
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, _BLOCK_STMTS):
+            children = list(node.body)
+            for handler in getattr(node, "handlers", ()):
+                children.extend(handler.body)
+            children.extend(getattr(node, "orelse", ()))
+            children.extend(getattr(node, "finalbody", ()))
+            stack.extend(reversed(children))
+
+
+def _parse_file_imports(py_file: Path):
+    """Top-level module names imported by one file; empty for unreadable or invalid files."""
     imported_modules = set()
+    try:
+        with open(py_file, "rb") as f:
+            source = f.read()
+    except OSError:
+        # Skip unreadable files
+        return imported_modules
 
-    for py_file in iter_python_files(root):
-        try:
-            with open(py_file, "r", encoding="utf-8") as f:
-                source = f.read()
-        except (UnicodeDecodeError, OSError):
-            # Skip unreadable files
-            continue
+    # no "import" token means no import statement; skip building the AST
+    if b"import" not in source:
+        return imported_modules
 
-        try:
-            tree = ast.parse(source, filename=str(py_file))
-        except SyntaxError:
-            # Skip files with syntax errors
-            continue
+    try:
+        # ast.parse decodes bytes itself (utf-8 or the file's coding cookie)
+        tree = ast.parse(source, filename=str(py_file))
+    except (SyntaxError, ValueError):
+        # Skip files with syntax errors, undecodable bytes or null bytes
+        return imported_modules
+
+    for node in _iter_module_level_nodes(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                # import x.y.z -> "x"
+                top_level = alias.name.split(".")[0]
+                imported_modules.add(top_level)
+        elif isinstance(node, ast.ImportFrom):
+            # from x.y import z -> "x"
+            if node.module is not None:
+                top_level = node.module.split(".")[0]
+                imported_modules.add(top_level)
+
+    return imported_modules
 
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Import):
-                for alias in node.names:
-                    # import x.y.z -> "x"
-                    top_level = alias.name.split(".")[0]
-                    imported_modules.add(top_level)
-            elif isinstance(node, ast.ImportFrom):
-                # from x.y import z -> "x"
-                if node.module is not None:
-                    top_level = node.module.split(".")[0]
-                    imported_modules.add(top_level)
 
+def collect_imports(root: Path):
+    """
+    Parse all .py files and collect top-level imported module names
+    (e.g. 'requests', 'torch', 'numpy') from module-level import statements.
+    Files are parsed in a process pool once there are enough of them to pay for it.
+    """
+    files = list(iter_python_files(root))
+    if len(files) < PARALLEL_MIN_FILES:
+        return set().union(*map(_parse_file_imports, files))
+
+    imported_modules = set()
+    with ProcessPoolExecutor() as ex:
+        for file_imports in ex.map(_parse_file_imports, files, chunksize=32):
+            imported_modules.update(file_imports)
     return imported_modules
 
 
-def map_modules_to_distributions(imported_modules):
+def _top_level_names(dist):
     """
-    Map imported module names to installed distributions using
-    importlib.metadata.packages_distributions().
+    Importable top-level names a distribution provides: its top_level.txt, else
+    inferred from its installed files (the same rule as packages_distributions()).
     """
-    try:
-        pkg_map = metadata.packages_distributions()
-    except Exception:
-        # Fallback: build map manually (less accurate, but better than nothing)
-        pkg_map = {}
-        for dist in metadata.distributions():
-            name = dist.metadata["Name"]
-            try:
-                top_levels = dist.read_text("top_level.txt")
-            except FileNotFoundError:
-                continue
-            if not top_levels:
-                continue
-            for line in top_levels.splitlines():
-                mod = line.strip()
-                if not mod:
-                    continue
-                pkg_map.setdefault(mod, set()).add(name)
-
-    module_to_dists = {}
-    for mod in imported_modules:
-        dists = pkg_map.get(mod, [])
-        # ensure it's a list
-        if isinstance(dists, (set, tuple)):
-            dists = list(dists)
-        module_to_dists[mod] = dists
-
-    return module_to_dists
-
-
-def get_installed_distributions():
-    """Return a dict: {dist_name_lower: dist} for all installed packages."""
+    top_levels = dist.read_text("top_level.txt")
+    if top_levels:
+        return top_levels.split()
+    # "pkg/mod.py" -> "pkg"; "mod.py" -> "mod"
+    return {
+        f.parts[0] if len(f.parts) > 1 else f.with_suffix("").name
+        for f in dist.files or ()
+        if f.suffix == ".py"
+    }
+
+
+def scan_distributions():
+    """
+    Single pass over the installed distributions, reading each METADATA once.
+    Returns (pkg_map, installed): {top_level_module: [dist_name, ...]} and
+    {dist_name_lower: dist}.
+    """
+    pkg_map = {}
     installed = {}
     for dist in metadata.distributions():
-        name = dist.metadata.get("Name")
+        name = dist.metadata.get("Name")  # .metadata re-reads METADATA on every access
         if not name:
             continue
         installed[name.lower()] = dist
-    return installed
+        for mod in _top_level_names(dist):
+            pkg_map.setdefault(mod, []).append(name)
+    return pkg_map, installed
+
+
+def map_modules_to_distributions(imported_modules, pkg_map):
+    """Map imported module names to the installed distributions providing them."""
+    return {mod: list(pkg_map.get(mod, [])) for mod in imported_modules}
 
 
 def main():
@@ -109,8 +151,8 @@ def main():
     imported_modules = collect_imports(PROJECT_ROOT)
     print(f"Found {len(imported_modules)} imported top-level modules in project.")
 
-    module_to_dists = map_modules_to_distributions(imported_modules)
-    installed = get_installed_distributions()
+    pkg_map, installed = scan_distributions()
+    module_to_dists = map_modules_to_distributions(imported_modules, pkg_map)
 
     used_distributions = set()
     for mod, dists in module_to_dists.items():
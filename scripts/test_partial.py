@@ -2,25 +2,37 @@ import os
 import json
 import pandas as pd
 
+try:
+    import orjson  # optional: faster per-line decoding
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import pyarrow  # noqa: F401  optional: multi-threaded CSV parsing, Arrow-backed columns
+    READ_CSV_KWARGS = {"engine": "pyarrow", "dtype_backend": "pyarrow"}
+except ImportError:
+    READ_CSV_KWARGS = {}
+
+CSV_WRITE_CHUNKSIZE = 10_000  # rows serialized per to_csv batch
+
 EXPERIMENTS_DIR = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\experiments"
 JSONL_PATH = r"C:\Users\msi-nb\Desktop\AIS\LiteReviewer\dataset\experiment.jsonl"
 
-def has_docstring(text: str) -> bool:
-    if not isinstance(text, str):
-        return False
-    return ('"""' in text) or ("'''" in text)
+def has_docstring(diffs: pd.Series) -> pd.Series:
+    # a diff "has a docstring" if it contains triple quotes
+    return diffs.str.contains('"""', regex=False) | diffs.str.contains("'''", regex=False)
 
 def load_has_docstr_flags(jsonl_path: str):
-    flags = []
-    with open(jsonl_path, "r", encoding="utf-8") as f:
+    diffs = []
+    with open(jsonl_path, "rb") as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if not line.strip():
                 continue
-            row = json.loads(line)
+            row = _loads(line)
             diff = row.get("diff_hunk", "")
-            flags.append(has_docstring(diff))
-    return flags
+            diffs.append(diff if isinstance(diff, str) else "")  # non-strings never have one
+    return has_docstring(pd.Series(diffs, dtype=object)).tolist()
 
 def insert_after_type(df: pd.DataFrame, col_name: str, values):
     if "type" not in df.columns:
@@ -52,13 +64,13 @@ def main():
 
     for csv_path in csv_files:
         try:
-            df = pd.read_csv(csv_path)
+            df = pd.read_csv(csv_path, **READ_CSV_KWARGS)
 
             # add column after "type"
             df = insert_after_type(df, "has_docstr", flags)
 
             # save inplace
-            df.to_csv(csv_path, index=False)
+            df.to_csv(csv_path, index=False, chunksize=CSV_WRITE_CHUNKSIZE)
             print(f"[OK] Updated: {csv_path}")
 
         except Exception as e: